@@ -38,6 +38,10 @@ def main() -> int:
 
     args = parser.parse_args()
 
+    # Import Twisted-based modules (server, upstream, the reactor) here,
+    # after argument parsing, never at module level: --help and --version
+    # exit inside parse_args() and should not pay for loading Twisted.
+
     # TODO: Implement proxy startup logic
     print(f"IMAP Granular Access Proxy starting on {args.host}:{args.port}")
     print(f"Using config: {args.config}")
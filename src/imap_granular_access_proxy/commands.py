@@ -0,0 +1,69 @@
+"""IMAP command vocabulary and tag helpers shared by the proxy modules.
+
+The server and the forwarding pipeline both keep per-command lookup
+tables (decoded names, encoded names) built from this single list so
+that they cannot drift apart, and both generate upstream tags in the
+same "P0001" format.
+"""
+
+from __future__ import annotations
+
+# Commands from RFC 3501 plus the widely deployed extensions (IDLE, ID,
+# NAMESPACE, ENABLE, MOVE, UNSELECT). Anything else a client sends is
+# still handled, just without the precomputed fast path.
+KNOWN_COMMANDS: tuple[str, ...] = (
+    "APPEND",
+    "AUTHENTICATE",
+    "CAPABILITY",
+    "CHECK",
+    "CLOSE",
+    "COPY",
+    "CREATE",
+    "DELETE",
+    "ENABLE",
+    "EXAMINE",
+    "EXPUNGE",
+    "FETCH",
+    "ID",
+    "IDLE",
+    "LIST",
+    "LOGIN",
+    "LOGOUT",
+    "LSUB",
+    "MOVE",
+    "NAMESPACE",
+    "NOOP",
+    "RENAME",
+    "SEARCH",
+    "SELECT",
+    "STARTTLS",
+    "STATUS",
+    "STORE",
+    "SUBSCRIBE",
+    "UID",
+    "UNSELECT",
+    "UNSUBSCRIBE",
+)
+
+# Number of upstream tags preformatted at import time (P0000..P9999).
+_TAG_TABLE_SIZE = 10000
+
+_UPSTREAM_TAGS: tuple[bytes, ...] = tuple(b"P%04d" % n for n in range(_TAG_TABLE_SIZE))
+
+
+def format_upstream_tag(tag_number: int) -> bytes:
+    """Format a tag counter value as an upstream tag.
+
+    Tags below P10000 come from a table built once at import, so the
+    per-command path is a single tuple index; larger values are
+    formatted on demand.
+
+    Args:
+        tag_number: A non-negative tag counter value.
+
+    Returns:
+        The tag, e.g. b"P0001" for 1 or b"P12345" for 12345.
+    """
+    if tag_number < _TAG_TABLE_SIZE:
+        return _UPSTREAM_TAGS[tag_number]
+    return b"P%d" % tag_number
@@ -7,13 +7,27 @@ tag rewriting to avoid collisions and maintains proper command tracking.
 
 from __future__ import annotations
 
+import itertools
 import logging
 import time
+from collections.abc import Iterable, Iterator, KeysView, Sequence
 from dataclasses import dataclass, field
 from typing import Protocol
 
+from .commands import KNOWN_COMMANDS, format_upstream_tag
+
 logger = logging.getLogger(__name__)
 
+# Pre-encoded names of the IMAP commands a client may issue, so the common
+# case of forwarding a command does not encode the name every time. Unknown
+# commands are encoded on demand and deliberately not cached, which keeps
+# the table bounded no matter what clients send.
+_COMMAND_BYTES: dict[str, bytes] = {name: name.encode("ascii") for name in KNOWN_COMMANDS}
+
+# Number of direct-mapped slots for in-flight commands (a power of two).
+_SLOT_COUNT = 64
+_SLOT_MASK = _SLOT_COUNT - 1
+
 
 class ResponseSender(Protocol):
     """Protocol for objects that can send IMAP responses.
@@ -39,7 +53,19 @@ class CommandSender(Protocol):
         ...
 
 
-@dataclass
+class TransportWriter(Protocol):
+    """Protocol for transports that accept raw, already-framed bytes.
+
+    This is used to write several command lines to the upstream server
+    with a single call instead of one sendLine() per command.
+    """
+
+    def writeSequence(self, data: Iterable[bytes]) -> None:
+        """Write a sequence of raw data chunks."""
+        ...
+
+
+@dataclass(slots=True)
 class ForwardedCommand:
     """Represents a command being forwarded from client to upstream.
 
@@ -49,6 +75,9 @@ class ForwardedCommand:
         command: The IMAP command name (uppercase).
         args: The command arguments, if any.
         timestamp: When the command was forwarded (monotonic time).
+            ForwardingPipeline only records this while debug logging is
+            enabled, since that is its only consumer, and sets it to 0.0
+            otherwise.
     """
 
     client_tag: bytes
@@ -58,6 +87,41 @@ class ForwardedCommand:
     timestamp: float = field(default_factory=time.monotonic)
 
 
+class _LineCollector:
+    """ResponseSender that queues CRLF-terminated lines for one write."""
+
+    __slots__ = ("chunks",)
+
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+
+    def sendLine(self, line: bytes) -> None:
+        self.chunks.append(line)
+        self.chunks.append(b"\r\n")
+
+
+def _upstream_tag_number(tag: bytes) -> int | None:
+    """Extract the counter value from an upstream tag.
+
+    The result is only a lookup key: for five-byte tags the digits are not
+    validated, so callers must still compare the tag found under that key
+    with the tag received.
+
+    Args:
+        tag: A tag such as b"P0001".
+
+    Returns:
+        The integer counter encoded in the tag, or None if the tag cannot
+        have been generated by the pipeline.
+    """
+    if len(tag) == 5 and tag[0] == 0x50:
+        # Fast path for the common four-digit tags: no slice, no int()
+        return (tag[1] - 48) * 1000 + (tag[2] - 48) * 100 + (tag[3] - 48) * 10 + tag[4] - 48
+    if tag[:1] != b"P" or not tag[1:].isdigit():
+        return None
+    return int(tag[1:])
+
+
 class ForwardingPipeline:
     """Manages the forwarding of IMAP commands and response routing.
 
@@ -72,13 +136,25 @@ class ForwardingPipeline:
     to avoid any collision with client-chosen tags.
     """
 
+    # Fixed attribute layout for the per-command hot paths
+    __slots__ = (
+        "_slots",
+        "_overflow",
+        "_client_to_upstream",
+        "_tag_counter",
+    )
+
     def __init__(self) -> None:
         """Initialize an empty forwarding pipeline."""
-        # Maps upstream_tag -> ForwardedCommand
-        self._in_flight: dict[bytes, ForwardedCommand] = {}
-        # Maps client_tag -> upstream_tag for reverse lookup
-        self._client_to_upstream: dict[bytes, bytes] = {}
-        self._tag_counter: int = 0
+        # In-flight commands, direct-mapped by upstream tag counter. Tags are
+        # sequential, so each command normally gets a slot of its own; if a
+        # slot is still held by an older command the new one goes to the
+        # overflow dict instead.
+        self._slots: list[ForwardedCommand | None] = [None] * _SLOT_COUNT
+        self._overflow: dict[int, ForwardedCommand] = {}
+        # Maps client_tag -> upstream tag counter for reverse lookup
+        self._client_to_upstream: dict[bytes, int] = {}
+        self._tag_counter: Iterator[int] = itertools.count(1)
 
     def generate_upstream_tag(self) -> bytes:
         """Generate a unique tag for the upstream server.
@@ -86,8 +162,7 @@ class ForwardingPipeline:
         Returns:
             A unique tag in the format "P0001", "P0002", etc.
         """
-        self._tag_counter += 1
-        return f"P{self._tag_counter:04d}".encode("ascii")
+        return format_upstream_tag(next(self._tag_counter))
 
     def forward_command(
         self,
@@ -114,35 +189,156 @@ class ForwardingPipeline:
         Raises:
             ValueError: If a command with this client tag is already in flight.
         """
-        if client_tag in self._client_to_upstream:
+        # Claim the client tag with a single insert-if-absent; a different
+        # value coming back means the tag is already in flight.
+        tag_number = next(self._tag_counter)
+        if self._client_to_upstream.setdefault(client_tag, tag_number) != tag_number:
             raise ValueError(f"Command with client tag {client_tag!r} already in flight")
 
-        upstream_tag = self.generate_upstream_tag()
+        cmd, line = self._track(client_tag, tag_number, command, args)
+        upstream.sendLine(line)
+
+        return cmd
+
+    def forward_commands_batch(
+        self,
+        commands: Sequence[tuple[bytes, str, bytes | None]],
+        upstream: TransportWriter,
+    ) -> list[ForwardedCommand]:
+        """Forward several commands to the upstream server in one write.
+
+        IMAP allows clients to pipeline commands without waiting for each
+        response (RFC 3501, section 5.5). This method rewrites and tracks
+        every command, then hands all of the CRLF-terminated lines to the
+        upstream transport in a single call. Responses are routed by tag
+        through route_response() exactly as for single commands.
+
+        Only batch commands whose results do not depend on each other.
+        Commands that change the connection state (e.g. LOGIN, SELECT,
+        EXAMINE, CLOSE) must not be followed by other commands in the
+        same batch, because the server may process them in any order
+        the RFC permits.
+
+        Args:
+            commands: (client_tag, command, args) tuples, in send order.
+            upstream: The upstream transport to write to.
+
+        Returns:
+            The ForwardedCommand tracking objects, in the same order.
+
+        Raises:
+            ValueError: If a client tag is already in flight or appears
+                more than once in the batch. Nothing is forwarded or
+                tracked in that case.
+        """
+        seen: set[bytes] = set()
+        for client_tag, _, _ in commands:
+            if client_tag in self._client_to_upstream or client_tag in seen:
+                raise ValueError(f"Command with client tag {client_tag!r} already in flight")
+            seen.add(client_tag)
+
+        forwarded: list[ForwardedCommand] = []
+        # Hand the transport the lines and terminators as a vector; Twisted
+        # queues the chunks as-is, so neither the lines nor the whole batch
+        # are copied into an intermediate buffer here.
+        chunks: list[bytes] = []
+        for client_tag, command, args in commands:
+            tag_number = next(self._tag_counter)
+            self._client_to_upstream[client_tag] = tag_number
+            cmd, line = self._track(client_tag, tag_number, command, args)
+            chunks.append(line)
+            chunks.append(b"\r\n")
+            forwarded.append(cmd)
+
+        if chunks:
+            upstream.writeSequence(chunks)
+        return forwarded
+
+    def _track(
+        self, client_tag: bytes, tag_number: int, command: str, args: bytes | None
+    ) -> tuple[ForwardedCommand, bytes]:
+        """Start tracking a command under its upstream tag.
+
+        The caller must already have mapped client_tag to tag_number.
+
+        Args:
+            client_tag: The tag used by the client.
+            tag_number: The upstream tag counter assigned to the command.
+            command: The IMAP command name (uppercase).
+            args: The command arguments, or None.
+
+        Returns:
+            The ForwardedCommand and the rewritten command line (without
+            line terminator).
+        """
+        upstream_tag = format_upstream_tag(tag_number)
+        debug = logger.isEnabledFor(logging.DEBUG)
         cmd = ForwardedCommand(
             client_tag=client_tag,
             upstream_tag=upstream_tag,
             command=command,
             args=args,
+            timestamp=time.monotonic() if debug else 0.0,
         )
 
-        self._in_flight[upstream_tag] = cmd
-        self._client_to_upstream[client_tag] = upstream_tag
+        index = tag_number & _SLOT_MASK
+        if self._slots[index] is None:
+            self._slots[index] = cmd
+        else:
+            self._overflow[tag_number] = cmd
 
-        # Build and send the command line
+        # Build the command line
+        command_bytes = _COMMAND_BYTES.get(command)
+        if command_bytes is None:
+            command_bytes = command.encode("ascii")
         if args:
-            line = upstream_tag + b" " + command.encode("ascii") + b" " + args
+            line = b" ".join((upstream_tag, command_bytes, args))
         else:
-            line = upstream_tag + b" " + command.encode("ascii")
+            line = b" ".join((upstream_tag, command_bytes))
 
-        logger.debug(
-            "Forwarding command: client=%r upstream=%r cmd=%s",
-            client_tag,
-            upstream_tag,
-            command,
-        )
-        upstream.sendLine(line)
+        if debug:
+            logger.debug(
+                "Forwarding command: client=%r upstream=%r cmd=%s",
+                client_tag,
+                upstream_tag,
+                command,
+            )
+        return cmd, line
 
-        return cmd
+    def _find(self, tag_number: int, upstream_tag: bytes) -> ForwardedCommand | None:
+        """Look up an in-flight command by its exact upstream tag.
+
+        Args:
+            tag_number: The counter value parsed from the tag.
+            upstream_tag: The tag as received, which must match exactly.
+
+        Returns:
+            The ForwardedCommand if found, None otherwise.
+        """
+        cmd = self._slots[tag_number & _SLOT_MASK]
+        if cmd is not None and cmd.upstream_tag == upstream_tag:
+            return cmd
+        if self._overflow:
+            cmd = self._overflow.get(tag_number)
+            if cmd is not None and cmd.upstream_tag == upstream_tag:
+                return cmd
+        return None
+
+    def _get(self, tag_number: int) -> ForwardedCommand | None:
+        """Look up an in-flight command by a counter known to be tracked."""
+        if self._overflow:
+            cmd = self._overflow.get(tag_number)
+            if cmd is not None:
+                return cmd
+        return self._slots[tag_number & _SLOT_MASK]
+
+    def _untrack(self, cmd: ForwardedCommand, tag_number: int) -> None:
+        """Remove a command from the slot table or the overflow dict."""
+        index = tag_number & _SLOT_MASK
+        if self._slots[index] is cmd:
+            self._slots[index] = None
+        else:
+            del self._overflow[tag_number]
 
     def route_response(
         self,
@@ -168,38 +364,88 @@ class ForwardingPipeline:
         if not line:
             return False
 
-        # Check for tagged response
-        if not line.startswith(b"*") and not line.startswith(b"+"):
-            # This is a tagged response - find the tag
-            space_idx = line.find(b" ")
-            if space_idx > 0:
-                upstream_tag = line[:space_idx]
-                rest = line[space_idx + 1 :]
-
-                cmd = self._in_flight.get(upstream_tag)
-                if cmd:
-                    # Rewrite the tag and send to client
-                    rewritten = cmd.client_tag + b" " + rest
-                    client.sendLine(rewritten)
-
-                    # Clean up tracking
-                    del self._in_flight[upstream_tag]
-                    del self._client_to_upstream[cmd.client_tag]
-
-                    elapsed = time.monotonic() - cmd.timestamp
-                    logger.debug(
-                        "Command completed: client=%r upstream=%r cmd=%s elapsed=%.3fs",
-                        cmd.client_tag,
-                        upstream_tag,
-                        cmd.command,
-                        elapsed,
-                    )
-                    return True
-
-        # Untagged or continuation - pass through
+        # Untagged (*) or continuation (+) - pass through. Indexing bytes
+        # yields an int, so this is a single compare rather than two
+        # startswith() calls.
+        first = line[0]
+        if first == 0x2A or first == 0x2B:
+            client.sendLine(line)
+            return False
+
+        # This is a tagged response - split off the tag in one pass
+        upstream_tag, sep, rest = line.partition(b" ")
+        tag_number = _upstream_tag_number(upstream_tag) if sep else None
+        if tag_number is not None:
+            # Fast path: the command sits in its direct-mapped slot
+            cmd = self._slots[tag_number & _SLOT_MASK]
+            if cmd is None or cmd.upstream_tag != upstream_tag:
+                cmd = self._find(tag_number, upstream_tag)
+            if cmd is not None:
+                # Rewrite the tag and send to client; join sizes the result
+                # once instead of building an intermediate "tag " object
+                client.sendLine(b" ".join((cmd.client_tag, rest)))
+
+                # Clean up tracking
+                self._untrack(cmd, tag_number)
+                del self._client_to_upstream[cmd.client_tag]
+
+                if logger.isEnabledFor(logging.DEBUG):
+                    if cmd.timestamp:
+                        logger.debug(
+                            "Command completed: client=%r upstream=%r cmd=%s elapsed=%.3fs",
+                            cmd.client_tag,
+                            upstream_tag,
+                            cmd.command,
+                            time.monotonic() - cmd.timestamp,
+                        )
+                    else:
+                        # Forwarded while DEBUG was off, so there is no start time
+                        logger.debug(
+                            "Command completed: client=%r upstream=%r cmd=%s",
+                            cmd.client_tag,
+                            upstream_tag,
+                            cmd.command,
+                        )
+                return True
+
+        # Unknown tag - pass through
         client.sendLine(line)
         return False
 
+    def route_responses_batch(
+        self,
+        lines: Iterable[bytes],
+        client: TransportWriter,
+    ) -> int:
+        """Route several upstream response lines to the client in one write.
+
+        Each line is handled exactly as by route_response(); the resulting
+        CRLF-terminated lines are then handed to the client transport in a
+        single call instead of one write per line. Use this when a burst of
+        lines (e.g. a multi-message FETCH) has arrived from upstream at once.
+
+        Like forward_commands_batch(), this takes the transport rather than
+        the protocol, so the lines bypass the protocol's sendLine() and are
+        not logged by it. Use route_response() where every outbound line
+        should appear in the "Sending:" debug log.
+
+        Args:
+            lines: The response lines from the upstream server, in order.
+            client: The client transport to write to (e.g. the client
+                protocol's transport).
+
+        Returns:
+            The number of lines that completed a forwarded command.
+        """
+        collector = _LineCollector()
+        completed = 0
+        for line in lines:
+            if self.route_response(line, collector):
+                completed += 1
+        if collector.chunks:
+            client.writeSequence(collector.chunks)
+        return completed
+
     def get_forwarded_by_client_tag(
         self, client_tag: bytes
     ) -> ForwardedCommand | None:
@@ -211,9 +457,9 @@ class ForwardingPipeline:
         Returns:
             The ForwardedCommand if found, None otherwise.
         """
-        upstream_tag = self._client_to_upstream.get(client_tag)
-        if upstream_tag:
-            return self._in_flight.get(upstream_tag)
+        tag_number = self._client_to_upstream.get(client_tag)
+        if tag_number is not None:
+            return self._get(tag_number)
         return None
 
     def get_forwarded_by_upstream_tag(
@@ -227,17 +473,24 @@ class ForwardingPipeline:
         Returns:
             The ForwardedCommand if found, None otherwise.
         """
-        return self._in_flight.get(upstream_tag)
+        tag_number = _upstream_tag_number(upstream_tag)
+        if tag_number is None:
+            return None
+        return self._find(tag_number, upstream_tag)
 
     @property
     def in_flight_count(self) -> int:
         """Return the number of commands currently in flight."""
-        return len(self._in_flight)
+        return len(self._client_to_upstream)
 
     @property
-    def in_flight_client_tags(self) -> frozenset[bytes]:
-        """Return all client tags with commands currently in flight."""
-        return frozenset(self._client_to_upstream.keys())
+    def in_flight_client_tags(self) -> KeysView[bytes]:
+        """Return all client tags with commands currently in flight.
+
+        This is a live view rather than a copy; take a snapshot (e.g. with
+        ``frozenset()``) if the pipeline may change while iterating.
+        """
+        return self._client_to_upstream.keys()
 
     def clear_all(self) -> int:
         """Clear all in-flight commands (e.g., on connection close).
@@ -245,8 +498,9 @@ class ForwardingPipeline:
         Returns:
             The number of commands that were cleared.
         """
-        count = len(self._in_flight)
-        self._in_flight.clear()
+        count = len(self._client_to_upstream)
+        self._slots = [None] * _SLOT_COUNT
+        self._overflow.clear()
         self._client_to_upstream.clear()
         if count > 0:
             logger.debug("Cleared %d in-flight forwarded commands", count)
@@ -264,14 +518,15 @@ class ForwardingPipeline:
         Returns:
             The cancelled ForwardedCommand, or None if not found.
         """
-        upstream_tag = self._client_to_upstream.pop(client_tag, None)
-        if upstream_tag:
-            cmd = self._in_flight.pop(upstream_tag, None)
+        tag_number = self._client_to_upstream.pop(client_tag, None)
+        if tag_number is not None:
+            cmd = self._get(tag_number)
             if cmd:
+                self._untrack(cmd, tag_number)
                 logger.debug(
                     "Cancelled command: client=%r upstream=%r cmd=%s",
                     client_tag,
-                    upstream_tag,
+                    cmd.upstream_tag,
                     cmd.command,
                 )
             return cmd
@@ -7,19 +7,51 @@ client connections on a configurable port using Twisted's IMAP4 framework.
 from __future__ import annotations
 
 import logging
+import sys
 import time
+from collections.abc import KeysView
 from dataclasses import dataclass, field
-from enum import Enum
+from enum import StrEnum
 from typing import Any
 
 from twisted.internet.protocol import Factory, connectionDone
 from twisted.mail import imap4
 from twisted.python.failure import Failure
 
+from .commands import KNOWN_COMMANDS, format_upstream_tag
+from .tcp import configure_tcp
+
 logger = logging.getLogger(__name__)
 
+# Decoded, interned names of the IMAP commands a client may issue, so
+# dispatchCommand does not decode the verb of every command. Unknown verbs
+# are decoded on demand and not cached, which keeps the table bounded.
+_COMMAND_NAMES: dict[bytes, str] = {
+    name.encode("ascii"): sys.intern(name) for name in KNOWN_COMMANDS
+}
+
+# Longest line (or argument string) logged verbatim at DEBUG level; longer
+# ones, such as literal-bearing APPEND or FETCH traffic, are cut short.
+_LOG_LINE_LIMIT = 256
+
+
+def _truncate(data: bytes | None, limit: int = _LOG_LINE_LIMIT) -> bytes | None:
+    """Shorten protocol data for logging.
+
+    Args:
+        data: The line or arguments to log, or None.
+        limit: Maximum number of bytes to keep.
+
+    Returns:
+        data itself if it is None or at most limit bytes long, otherwise
+        its first limit bytes followed by a marker with the omitted length.
+    """
+    if data is None or len(data) <= limit:
+        return data
+    return data[:limit] + b"...<%d more bytes>" % (len(data) - limit)
+
 
-@dataclass
+@dataclass(slots=True)
 class PendingCommand:
     """Represents an in-flight IMAP command awaiting a response.
 
@@ -28,6 +60,9 @@ class PendingCommand:
         command: The IMAP command name (uppercase).
         args: The command arguments, if any.
         timestamp: When the command was received (monotonic time).
+            CommandTagTracker only records this while debug logging is
+            enabled, since that is its only consumer, and sets it to 0.0
+            otherwise.
         upstream_tag: The tag used when forwarding to upstream (may differ).
     """
 
@@ -51,6 +86,8 @@ class CommandTagTracker:
     - Handle timeouts for commands that never receive responses
     """
 
+    __slots__ = ("_pending", "_tag_counter")
+
     def __init__(self) -> None:
         """Initialize an empty command tracker."""
         self._pending: dict[bytes, PendingCommand] = {}
@@ -72,12 +109,16 @@ class CommandTagTracker:
         Raises:
             ValueError: If a command with this tag is already pending.
         """
-        if tag in self._pending:
+        debug = logger.isEnabledFor(logging.DEBUG)
+        # Positional arguments: keyword binding roughly doubles the cost of
+        # the generated __init__, and this runs for every command.
+        cmd = PendingCommand(tag, command, args, time.monotonic() if debug else 0.0)
+        # Insert-if-absent: a single hash probe on the common path, and an
+        # existing command under the same tag is left untouched.
+        if self._pending.setdefault(tag, cmd) is not cmd:
             raise ValueError(f"Duplicate command tag: {tag!r}")
-
-        cmd = PendingCommand(client_tag=tag, command=command, args=args)
-        self._pending[tag] = cmd
-        logger.debug("Registered pending command: tag=%r cmd=%s", tag, command)
+        if debug:
+            logger.debug("Registered pending command: tag=%r cmd=%s", tag, command)
         return cmd
 
     def complete_command(self, tag: bytes) -> PendingCommand | None:
@@ -90,14 +131,17 @@ class CommandTagTracker:
             The completed PendingCommand, or None if not found.
         """
         cmd = self._pending.pop(tag, None)
-        if cmd:
-            elapsed = time.monotonic() - cmd.timestamp
-            logger.debug(
-                "Completed command: tag=%r cmd=%s elapsed=%.3fs",
-                tag,
-                cmd.command,
-                elapsed,
-            )
+        if cmd and logger.isEnabledFor(logging.DEBUG):
+            if cmd.timestamp:
+                logger.debug(
+                    "Completed command: tag=%r cmd=%s elapsed=%.3fs",
+                    tag,
+                    cmd.command,
+                    time.monotonic() - cmd.timestamp,
+                )
+            else:
+                # Registered while DEBUG was off, so there is no start time
+                logger.debug("Completed command: tag=%r cmd=%s", tag, cmd.command)
         return cmd
 
     def get_pending(self, tag: bytes) -> PendingCommand | None:
@@ -128,9 +172,13 @@ class CommandTagTracker:
         return len(self._pending)
 
     @property
-    def pending_tags(self) -> frozenset[bytes]:
-        """Return all currently pending tags."""
-        return frozenset(self._pending.keys())
+    def pending_tags(self) -> KeysView[bytes]:
+        """Return all currently pending tags.
+
+        This is a live view rather than a copy; take a snapshot (e.g. with
+        ``frozenset()``) if the tracker may change while iterating.
+        """
+        return self._pending.keys()
 
     def generate_upstream_tag(self) -> bytes:
         """Generate a unique tag for forwarding to upstream.
@@ -141,8 +189,12 @@ class CommandTagTracker:
         Returns:
             A unique tag in the format "P0001", "P0002", etc.
         """
+        # The counter deliberately never wraps: the tracker is keyed by client
+        # tag and cannot tell which upstream tags are still in flight, so a
+        # wrapped tag could collide with a long-running command (e.g. IDLE).
+        # It stays a single-digit int for the first 2**30 commands anyway.
         self._tag_counter += 1
-        return f"P{self._tag_counter:04d}".encode("ascii")
+        return format_upstream_tag(self._tag_counter)
 
     def clear_all(self) -> int:
         """Clear all pending commands (e.g., on connection close).
@@ -157,7 +209,7 @@ class CommandTagTracker:
         return count
 
 
-class IMAPState(Enum):
+class IMAPState(StrEnum):
     """IMAP connection states as defined in RFC 3501.
 
     The IMAP protocol defines four states:
@@ -166,6 +218,10 @@ class IMAPState(Enum):
     - SELECTED: After successful SELECT/EXAMINE of a mailbox
     - LOGOUT: Connection is being terminated
     - TIMEOUT: Connection timed out (Twisted-specific)
+
+    Members are str subclasses equal to Twisted's own state strings, so
+    code holding a raw ``IMAP4Server.state`` can compare it against a
+    member directly without converting it first.
     """
 
     NOT_AUTHENTICATED = "unauth"
@@ -175,6 +231,11 @@ class IMAPState(Enum):
     TIMEOUT = "timeout"
 
 
+# Twisted state string -> IMAPState, so imap_state is a plain dict lookup
+# rather than a call through EnumMeta.
+_STATE_MAP: dict[str, IMAPState] = {state.value: state for state in IMAPState}
+
+
 class IMAPServerProtocol(imap4.IMAP4Server):
     """Protocol handler for incoming IMAP client connections.
 
@@ -185,6 +246,24 @@ class IMAPServerProtocol(imap4.IMAP4Server):
     factory: IMAPServerFactory
     _selected_mailbox: str | None = None
     _tag_tracker: CommandTagTracker
+    _peer_str: str = "unknown peer"
+    # Commands a client may issue, as uppercase names; None allows all.
+    # Subclasses can restrict the vocabulary by setting this instead of
+    # overriding check_command(). UID FETCH, STORE, COPY and SEARCH are
+    # checked twice, as "UID" and then as the subcommand, so both names
+    # must be listed.
+    allowed_commands: frozenset[str] | None = None
+
+    # IMAP4Server implementations of the per-line and per-command hooks
+    # overridden below, bound once here so those overrides avoid a super()
+    # lookup on every call. Nothing sits between this class and IMAP4Server
+    # in the MRO, so this is equivalent to super() for these methods.
+    _base_lineReceived = imap4.IMAP4Server.lineReceived
+    _base_sendLine = imap4.IMAP4Server.sendLine
+    _base_dispatchCommand = imap4.IMAP4Server.dispatchCommand
+    _base_sendPositiveResponse = imap4.IMAP4Server.sendPositiveResponse
+    _base_sendNegativeResponse = imap4.IMAP4Server.sendNegativeResponse
+    _base_sendBadResponse = imap4.IMAP4Server.sendBadResponse
 
     def __init__(self) -> None:
         """Initialize the protocol with a command tag tracker."""
@@ -203,7 +282,7 @@ class IMAPServerProtocol(imap4.IMAP4Server):
         Returns:
             The current IMAPState based on Twisted's internal state string.
         """
-        return IMAPState(self.state)
+        return _STATE_MAP[self.state]
 
     @property
     def selected_mailbox(self) -> str | None:
@@ -216,16 +295,18 @@ class IMAPServerProtocol(imap4.IMAP4Server):
 
     def connectionMade(self) -> None:
         """Called when a client connects."""
-        assert self.transport is not None
-        peer = self.transport.getPeer()  # ty: ignore[too-many-positional-arguments]
-        logger.info("Client connected from %s:%d", peer.host, peer.port)
+        configure_tcp(self.transport)
+        # The peer is only needed for logging; look it up (once - it cannot
+        # change) only when INFO messages will actually be emitted.
+        if logger.isEnabledFor(logging.INFO):
+            peer = self.transport.getPeer()  # ty: ignore[too-many-positional-arguments, possibly-missing-attribute]
+            self._peer_str = f"{peer.host}:{peer.port}"
+            logger.info("Client connected from %s", self._peer_str)
         super().connectionMade()
 
     def connectionLost(self, reason: Failure = connectionDone) -> None:
         """Called when the client connection is lost."""
-        assert self.transport is not None
-        peer = self.transport.getPeer()  # ty: ignore[too-many-positional-arguments]
-        logger.info("Client disconnected from %s:%d", peer.host, peer.port)
+        logger.info("Client disconnected from %s", self._peer_str)
         # Clear any pending commands that won't receive responses
         cleared = self._tag_tracker.clear_all()
         if cleared > 0:
@@ -234,13 +315,15 @@ class IMAPServerProtocol(imap4.IMAP4Server):
 
     def lineReceived(self, line: bytes) -> None:
         """Called when a line is received from the client."""
-        logger.debug("Received: %r", line)
-        super().lineReceived(line)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received: %r", _truncate(line))
+        self._base_lineReceived(line)
 
     def sendLine(self, line: bytes) -> None:
         """Called when sending a line to the client."""
-        logger.debug("Sending: %r", line)
-        super().sendLine(line)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending: %r", _truncate(line))
+        self._base_sendLine(line)
 
     def dispatchCommand(
         self, tag: bytes, cmd: bytes, rest: bytes | None, uid: int | None = None
@@ -256,20 +339,33 @@ class IMAPServerProtocol(imap4.IMAP4Server):
             rest: The remaining arguments, or None
             uid: UID prefix flag for UID commands
         """
-        cmd_str = cmd.decode("ascii", errors="replace")
-        logger.debug(
-            "Command: tag=%r cmd=%s args=%r state=%s",
-            tag,
-            cmd_str,
-            rest,
-            self.imap_state.name,
-        )
+        cmd_str = _COMMAND_NAMES.get(cmd)
+        if cmd_str is None:
+            cmd_str = cmd.decode("ascii", errors="replace")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Command: tag=%r cmd=%s args=%r state=%s",
+                tag,
+                cmd_str,
+                _truncate(rest),
+                self.imap_state.name,
+            )
 
         # Hook point for ACL checks - subclasses or future code can
         # override check_command() to implement access control
         if not self.check_command(tag, cmd_str, rest):
+            if uid:
+                # IMAP4Server.do_UID re-dispatches FETCH, STORE, COPY and
+                # SEARCH under the tag the outer UID command registered,
+                # so the rejection finishes that command.
+                self._tag_tracker.complete_command(tag)
             return  # Command was rejected
 
+        if uid:
+            # Already tracked under the outer UID command
+            self._base_dispatchCommand(tag, cmd, rest, uid)
+            return
+
         # Track the command for response routing
         try:
             self._tag_tracker.register_command(tag, cmd_str, rest)
@@ -278,13 +374,19 @@ class IMAPServerProtocol(imap4.IMAP4Server):
             self.sendBadResponse(tag, b"Command tag already in use")
             return
 
-        super().dispatchCommand(tag, cmd, rest, uid)
+        self._base_dispatchCommand(tag, cmd, rest, uid)
 
     def check_command(self, tag: bytes, cmd: str, args: bytes | None) -> bool:
         """Check if a command should be allowed.
 
-        Override this method to implement ACL checks. Return False to
-        reject the command (and send an appropriate error response).
+        The default implementation allows everything unless
+        allowed_commands is set, in which case commands outside that set
+        are rejected with a NO response. Override this method to implement
+        finer-grained ACL checks. Return False to reject the command (and
+        send an appropriate error response).
+
+        A UID command is checked once as "UID" and again as its FETCH,
+        STORE, COPY or SEARCH subcommand, with the same tag.
 
         Args:
             tag: The command tag
@@ -294,8 +396,14 @@ class IMAPServerProtocol(imap4.IMAP4Server):
         Returns:
             True to allow the command, False to reject it.
         """
-        # Default: allow all commands (ACL logic will be added later)
-        return True
+        allowed = self.allowed_commands
+        if allowed is None or cmd in allowed:
+            return True
+        # The rejected command was never registered, so bypass the tracker:
+        # completing the tag here would drop an in-flight command that
+        # happens to use the same tag.
+        self._base_sendNegativeResponse(tag, b"Command not permitted")
+        return False
 
     def sendPositiveResponse(
         self, tag: bytes | None = None, message: bytes = b""
@@ -303,7 +411,7 @@ class IMAPServerProtocol(imap4.IMAP4Server):
         """Send an OK response and complete the command tracking."""
         if tag is not None:
             self._tag_tracker.complete_command(tag)
-        super().sendPositiveResponse(tag, message)
+        self._base_sendPositiveResponse(tag, message)
 
     def sendNegativeResponse(
         self, tag: bytes | None = None, message: bytes = b""
@@ -311,7 +419,7 @@ class IMAPServerProtocol(imap4.IMAP4Server):
         """Send a NO response and complete the command tracking."""
         if tag is not None:
             self._tag_tracker.complete_command(tag)
-        super().sendNegativeResponse(tag, message)
+        self._base_sendNegativeResponse(tag, message)
 
     def sendBadResponse(
         self, tag: bytes | None = None, message: bytes = b""
@@ -319,7 +427,7 @@ class IMAPServerProtocol(imap4.IMAP4Server):
         """Send a BAD response and complete the command tracking."""
         if tag is not None:
             self._tag_tracker.complete_command(tag)
-        super().sendBadResponse(tag, message)
+        self._base_sendBadResponse(tag, message)
 
 
 class IMAPServerFactory(Factory):
@@ -0,0 +1,32 @@
+"""TCP socket tuning shared by the client-facing and upstream protocols."""
+
+from __future__ import annotations
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def configure_tcp(transport: object) -> None:
+    """Enable TCP_NODELAY and SO_KEEPALIVE on a connection's socket.
+
+    IMAP is a line-based request/response protocol, so Nagle's algorithm
+    combined with delayed ACKs only adds latency to small commands and
+    responses. Keepalive lets the kernel notice peers that vanished while a
+    connection sits idle (e.g. during IDLE or in the upstream pool).
+
+    Transports without these options (TLS wrappers forward them to the
+    underlying TCP transport, test transports do not have them) are left
+    unchanged. The tuning is best-effort: a socket the peer has already
+    reset may refuse the options, and that must not abort connectionMade.
+
+    Args:
+        transport: The transport of a newly made connection.
+    """
+    try:
+        transport.setTcpNoDelay(True)  # type: ignore[attr-defined]
+        transport.setTcpKeepAlive(True)  # type: ignore[attr-defined]
+    except AttributeError:
+        logger.debug("Transport %r does not support TCP options", transport)
+    except OSError as e:
+        logger.debug("Could not set TCP options on %r: %s", transport, e)
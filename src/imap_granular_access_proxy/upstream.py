@@ -6,22 +6,55 @@ connections to upstream IMAP servers using Twisted's IMAP4 framework.
 
 from __future__ import annotations
 
+import functools
+import itertools
 import logging
 from dataclasses import dataclass
 from typing import TYPE_CHECKING
 
 from twisted.internet import defer
 from twisted.internet.protocol import ClientFactory, connectionDone
+from twisted.internet.task import LoopingCall
 from twisted.mail import imap4
 from twisted.python.failure import Failure
 
+from .tcp import configure_tcp
+
 if TYPE_CHECKING:
-    from twisted.internet.interfaces import IAddress
+    from twisted.internet.interfaces import IAddress, IOpenSSLClientConnectionCreator
 
 logger = logging.getLogger(__name__)
 
+# Idle pooled connections are sent a NOOP this often (seconds), which keeps
+# them under the common ~30 minute IMAP server idle timeout.
+DEFAULT_KEEPALIVE_INTERVAL = 25 * 60
+
+# Tags for UpstreamIMAPProtocol.send_command() use their own prefix, so
+# they are never confused with ForwardingPipeline's "P" tags or with
+# IMAP4Client's own tags, which are bare hex digits.
+_PIPELINE_TAG_PREFIX = b"K"
+
+
+@functools.lru_cache(maxsize=64)
+def _tls_options(hostname: str) -> IOpenSSLClientConnectionCreator:
+    """Return client TLS options for an upstream host.
+
+    Building the options creates an OpenSSL context and loads the platform
+    trust roots, so they are built once per hostname and shared by every
+    connection to that host.
+
+    Args:
+        hostname: The upstream hostname to verify the certificate against.
+
+    Returns:
+        The connection creator to pass to wrapClientTLS.
+    """
+    from twisted.internet import ssl
+
+    return ssl.optionsForClientTLS(hostname=hostname)
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class UpstreamConfig:
     """Configuration for an upstream IMAP server.
 
@@ -49,28 +82,105 @@ class UpstreamIMAPProtocol(imap4.IMAP4Client):
 
     factory: UpstreamIMAPClientFactory
     _greeting_deferred: defer.Deferred[UpstreamIMAPProtocol] | None = None
+    _peer_str: str = "unknown peer"
+    _pool: UpstreamPool | None = None
+
+    def __init__(self, contextFactory: object = None) -> None:
+        """Initialize the protocol with no pipelined commands in flight.
+
+        Args:
+            contextFactory: TLS context factory for STARTTLS, if any.
+        """
+        super().__init__(contextFactory)
+        # Pipelined commands awaiting their tagged completion, by tag
+        self._pipelined: dict[bytes, defer.Deferred[bytes]] = {}
+        self._pipeline_tags = itertools.count(1)
 
     def connectionMade(self) -> None:
         """Called when the connection to the upstream server is established."""
-        assert self.transport is not None
-        peer = self.transport.getPeer()  # ty: ignore[too-many-positional-arguments]
-        logger.info("Connected to upstream %s:%d", peer.host, peer.port)
+        configure_tcp(self.transport)
+        # As in the server protocol, the peer is only needed for logging, so
+        # look it up once and only when INFO messages will be emitted.
+        if logger.isEnabledFor(logging.INFO):
+            peer = self.transport.getPeer()  # ty: ignore[too-many-positional-arguments, possibly-missing-attribute]
+            self._peer_str = f"{peer.host}:{peer.port}"
+            logger.info("Connected to upstream %s", self._peer_str)
         super().connectionMade()
 
     def connectionLost(self, reason: Failure = connectionDone) -> None:
         """Called when the upstream connection is lost."""
-        assert self.transport is not None
-        peer = self.transport.getPeer()  # ty: ignore[too-many-positional-arguments]
-        logger.info("Disconnected from upstream %s:%d", peer.host, peer.port)
+        logger.info("Disconnected from upstream %s", self._peer_str)
+        if self._pool is not None:
+            self._pool.discard(self)
+        pipelined, self._pipelined = self._pipelined, {}
+        for d in pipelined.values():
+            d.errback(reason)
         super().connectionLost(reason)
 
+    def send_command(self, command: str, args: bytes | None = None) -> defer.Deferred[bytes]:
+        """Send a command without waiting for earlier commands to complete.
+
+        IMAP4Client.sendCommand() queues each command until the previous
+        one has completed. This writes the command immediately instead, so
+        any number of commands can be in flight at once (RFC 3501, section
+        5.5), and completions are matched to commands by tag.
+
+        Pipelined commands are tagged "K0001", "K0002", ... and must not be
+        mixed with IMAP4Client's own command methods while in flight, since
+        untagged responses cannot be attributed to either. Untagged
+        responses are handled by IMAP4Client as unsolicited data. The
+        connection must not carry ForwardingPipeline commands either:
+        IMAP4Client treats their tagged completions as unknown tags and
+        drops the connection.
+
+        Args:
+            command: The IMAP command name (uppercase).
+            args: The command arguments, or None.
+
+        Returns:
+            A Deferred that fires with the text of the tagged OK response
+            (e.g. b"OK NOOP completed"), or fails with IMAP4Exception
+            carrying the NO/BAD response text.
+        """
+        tag = b"%s%04d" % (_PIPELINE_TAG_PREFIX, next(self._pipeline_tags))
+        d: defer.Deferred[bytes] = defer.Deferred()
+        self._pipelined[tag] = d
+        command_bytes = command.encode("ascii")
+        if args is None:
+            self.sendLine(b" ".join((tag, command_bytes)))
+        else:
+            self.sendLine(b" ".join((tag, command_bytes, args)))
+        return d
+
+    def lineReceived(self, line: bytes) -> None:
+        """Complete pipelined commands, passing other lines to IMAP4Client.
+
+        Args:
+            line: A response line from the upstream server.
+        """
+        # Only look at complete lines; while a literal is being assembled
+        # IMAP4Client owns the input.
+        if self._pipelined and self._parts is None:
+            tag, sep, rest = line.partition(b" ")
+            d = self._pipelined.pop(tag, None) if sep else None
+            if d is not None:
+                if self.timeout > 0:
+                    self.resetTimeout()
+                if rest.partition(b" ")[0].upper() == b"OK":
+                    d.callback(rest)
+                else:
+                    d.errback(imap4.IMAP4Exception(rest))
+                return
+        super().lineReceived(line)
+
     def serverGreeting(self, caps: dict[bytes, list[bytes] | None]) -> None:
         """Called when the server sends its initial greeting.
 
         Args:
             caps: The server's advertised capabilities.
         """
-        logger.debug("Upstream server greeting received, capabilities: %r", caps)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Upstream server greeting received, capabilities: %r", caps)
         self.serverCapabilities = caps
         if self._greeting_deferred is not None:
             d, self._greeting_deferred = self._greeting_deferred, None
@@ -96,6 +206,14 @@ class UpstreamIMAPClientFactory(ClientFactory):
         self.config = config
         self._connection_deferred: defer.Deferred[UpstreamIMAPProtocol] | None = None
         self._protocol: UpstreamIMAPProtocol | None = None
+        # The authenticators only hold the username, so one set is shared by
+        # every connection this factory builds.
+        username_bytes = config.username.encode("utf-8")
+        self._authenticators: tuple[imap4.IClientAuthentication, ...] = (
+            imap4.PLAINAuthenticator(username_bytes),
+            imap4.LOGINAuthenticator(username_bytes),
+            imap4.CramMD5ClientAuthenticator(username_bytes),
+        )
 
     def buildProtocol(self, addr: IAddress) -> UpstreamIMAPProtocol:
         """Build a protocol instance for a new connection.
@@ -114,10 +232,8 @@ class UpstreamIMAPClientFactory(ClientFactory):
         proto._greeting_deferred = self._connection_deferred
 
         # Register authenticators for the upstream server
-        username_bytes = self.config.username.encode("utf-8")
-        proto.registerAuthenticator(imap4.PLAINAuthenticator(username_bytes))
-        proto.registerAuthenticator(imap4.LOGINAuthenticator(username_bytes))
-        proto.registerAuthenticator(imap4.CramMD5ClientAuthenticator(username_bytes))
+        for authenticator in self._authenticators:
+            proto.registerAuthenticator(authenticator)
 
         logger.debug("Built upstream protocol for %s:%d", self.config.host, self.config.port)
         return proto
@@ -172,7 +288,7 @@ class UpstreamIMAPClientFactory(ClientFactory):
         Returns:
             A Deferred that fires with the connected protocol.
         """
-        from twisted.internet import endpoints, ssl
+        from twisted.internet import endpoints
 
         self._connection_deferred = defer.Deferred()
 
@@ -183,7 +299,7 @@ class UpstreamIMAPClientFactory(ClientFactory):
         )
 
         if self.config.use_tls:
-            context_factory = ssl.optionsForClientTLS(hostname=self.config.host)
+            context_factory = _tls_options(self.config.host)
             endpoint = endpoints.wrapClientTLS(
                 context_factory,
                 endpoint,  # type: ignore[arg-type]
@@ -199,3 +315,127 @@ class UpstreamIMAPClientFactory(ClientFactory):
         # Connect and return the deferred that fires on server greeting
         endpoint.connect(self)  # type: ignore[arg-type]
         return self._connection_deferred
+
+
+class UpstreamPool:
+    """Pool of idle upstream connections, keyed by their UpstreamConfig.
+
+    Establishing an upstream connection (TCP, TLS and authentication) is by
+    far the most expensive step of proxying a session, so connections that
+    are no longer needed can be checked back in and handed to the next
+    checkout for the same server and account instead of being closed.
+
+    Connections are only handed out for an identical configuration (host,
+    port, credentials and TLS setting), so a checkout never receives a
+    plaintext connection when it asked for TLS, or one authenticated with
+    different credentials.
+
+    Only connections in a reusable state should be checked in; the pool does
+    not reset the IMAP state (e.g. a selected mailbox) of a connection.
+    Connections are dropped from the pool as soon as they are lost, and idle
+    ones are kept alive with a periodic NOOP once start() has been called.
+    """
+
+    def __init__(
+        self,
+        reactor: object,
+        max_idle: int = 4,
+        keepalive_interval: float = DEFAULT_KEEPALIVE_INTERVAL,
+    ) -> None:
+        """Initialize an empty pool.
+
+        Args:
+            reactor: The Twisted reactor used for connecting and keepalives.
+            max_idle: Maximum number of idle connections kept per key.
+            keepalive_interval: Seconds between keepalive NOOPs.
+        """
+        self._reactor = reactor
+        self._max_idle = max_idle
+        self._keepalive_interval = keepalive_interval
+        self._idle: dict[UpstreamConfig, list[UpstreamIMAPProtocol]] = {}
+        self._keepalive: LoopingCall | None = None
+
+    def checkout(self, config: UpstreamConfig) -> defer.Deferred[UpstreamIMAPProtocol]:
+        """Get a connection to the given upstream server.
+
+        Args:
+            config: Configuration for the upstream server.
+
+        Returns:
+            A Deferred that fires with an idle pooled connection if one is
+            available, or with a newly established connection otherwise.
+        """
+        idle = self._idle.get(config)
+        if idle:
+            proto = idle.pop()
+            logger.debug("Reusing pooled upstream connection to %s", proto._peer_str)
+            return defer.succeed(proto)
+        return UpstreamIMAPClientFactory(config).connect(self._reactor)
+
+    def checkin(self, proto: UpstreamIMAPProtocol) -> None:
+        """Return a connection to the pool for reuse.
+
+        If the pool already holds max_idle connections for the same
+        configuration, the connection is closed instead.
+
+        Args:
+            proto: A connection previously obtained from checkout().
+        """
+        idle = self._idle.setdefault(proto.factory.config, [])
+        if len(idle) >= self._max_idle:
+            proto._pool = None
+            assert proto.transport is not None
+            proto.transport.loseConnection()  # ty: ignore[too-many-positional-arguments]
+            return
+        proto._pool = self
+        idle.append(proto)
+
+    def discard(self, proto: UpstreamIMAPProtocol) -> None:
+        """Remove a connection from the pool, e.g. because it was lost.
+
+        Args:
+            proto: The connection to remove. Unknown connections are ignored.
+        """
+        proto._pool = None
+        idle = self._idle.get(proto.factory.config)
+        if idle and proto in idle:
+            idle.remove(proto)
+
+    @property
+    def idle_count(self) -> int:
+        """Return the number of idle connections across all keys."""
+        return sum(len(idle) for idle in self._idle.values())
+
+    def start(self) -> None:
+        """Start sending keepalive NOOPs on idle connections."""
+        if self._keepalive is None:
+            self._keepalive = LoopingCall(self._send_keepalives)
+            self._keepalive.clock = self._reactor  # type: ignore[assignment]
+            self._keepalive.start(self._keepalive_interval, now=False)
+
+    def stop(self) -> None:
+        """Stop the keepalive timer; idle connections are left open."""
+        if self._keepalive is not None:
+            self._keepalive.stop()
+            self._keepalive = None
+
+    def _send_keepalives(self) -> None:
+        for idle in self._idle.values():
+            for proto in list(idle):
+                d = proto.noop()
+                d.addErrback(self._keepalive_failed, proto)
+
+    def _keepalive_failed(self, failure: Failure, proto: UpstreamIMAPProtocol) -> None:
+        logger.warning(
+            "Keepalive failed for pooled upstream connection to %s: %s",
+            proto._peer_str,
+            failure.getErrorMessage(),
+        )
+        idle = self._idle.get(proto.factory.config)
+        if not idle or proto not in idle:
+            # Checked out while the NOOP was outstanding; the caller now owns
+            # the connection and will see the failure itself.
+            return
+        self.discard(proto)
+        if proto.transport is not None:
+            proto.transport.loseConnection()  # ty: ignore[too-many-positional-arguments]
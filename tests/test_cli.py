@@ -1,5 +1,8 @@
 """Tests for CLI module."""
 
+import subprocess
+import sys
+
 from imap_granular_access_proxy.cli import main
 
 
@@ -11,3 +14,14 @@ def test_main_returns_zero(capsys, monkeypatch):
 
     captured = capsys.readouterr()
     assert "IMAP Granular Access Proxy" in captured.out
+
+
+def test_cli_import_does_not_load_twisted():
+    """Importing the CLI should not import Twisted (keeps --help/--version fast)."""
+    code = (
+        "import sys\n"
+        "import imap_granular_access_proxy.cli\n"
+        "sys.exit('twisted' in sys.modules)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], check=False)  # noqa: S603
+    assert result.returncode == 0
@@ -0,0 +1,37 @@
+"""Tests for the shared command vocabulary and tag helpers."""
+
+from imap_granular_access_proxy.commands import KNOWN_COMMANDS, format_upstream_tag
+
+
+class TestKnownCommands:
+    """Tests for KNOWN_COMMANDS."""
+
+    def test_names_are_uppercase_and_unique(self) -> None:
+        """Command names should be canonical uppercase and listed once."""
+        assert all(name == name.upper() for name in KNOWN_COMMANDS)
+        assert len(set(KNOWN_COMMANDS)) == len(KNOWN_COMMANDS)
+
+    def test_core_commands_present(self) -> None:
+        """The RFC 3501 core commands should all be known."""
+        for name in ("LOGIN", "SELECT", "FETCH", "STORE", "UID", "LOGOUT"):
+            assert name in KNOWN_COMMANDS
+
+
+class TestFormatUpstreamTag:
+    """Tests for format_upstream_tag."""
+
+    def test_zero_padded_below_ten_thousand(self) -> None:
+        """Tags in the preformatted range should be zero-padded to four digits."""
+        assert format_upstream_tag(1) == b"P0001"
+        assert format_upstream_tag(42) == b"P0042"
+        assert format_upstream_tag(9999) == b"P9999"
+
+    def test_widens_past_table(self) -> None:
+        """Tags beyond the table should keep counting without padding."""
+        assert format_upstream_tag(10000) == b"P10000"
+        assert format_upstream_tag(123456) == b"P123456"
+
+    def test_matches_on_demand_formatting(self) -> None:
+        """Table entries should equal what on-demand formatting would produce."""
+        for n in (0, 7, 999, 1000, 5000):
+            assert format_upstream_tag(n) == b"P%04d" % n
@@ -1,5 +1,9 @@
 """Tests for command forwarding pipeline."""
 
+import itertools
+import logging
+from collections.abc import Iterable
+
 import pytest
 
 from imap_granular_access_proxy.forwarding import (
@@ -18,6 +22,16 @@ class MockSender:
         self.sent_lines.append(line)
 
 
+class MockTransport:
+    """Mock transport for testing that records all raw writes."""
+
+    def __init__(self) -> None:
+        self.writes: list[bytes] = []
+
+    def writeSequence(self, data: Iterable[bytes]) -> None:
+        self.writes.append(b"".join(data))
+
+
 class TestForwardedCommand:
     """Tests for ForwardedCommand dataclass."""
 
@@ -54,6 +68,16 @@ class TestForwardedCommand:
         )
         assert cmd.args is None
 
+    def test_has_no_instance_dict(self) -> None:
+        """ForwardedCommand should use slots instead of a per-instance dict."""
+        cmd = ForwardedCommand(
+            client_tag=b"A001",
+            upstream_tag=b"P0001",
+            command="NOOP",
+            args=None,
+        )
+        assert not hasattr(cmd, "__dict__")
+
 
 class TestForwardingPipelineBasics:
     """Basic tests for ForwardingPipeline."""
@@ -64,6 +88,10 @@ class TestForwardingPipelineBasics:
         assert pipeline.in_flight_count == 0
         assert len(pipeline.in_flight_client_tags) == 0
 
+    def test_has_no_instance_dict(self) -> None:
+        """ForwardingPipeline should use slots instead of a per-instance dict."""
+        assert not hasattr(ForwardingPipeline(), "__dict__")
+
     def test_generate_upstream_tag_increments(self) -> None:
         """generate_upstream_tag should produce incrementing tags."""
         pipeline = ForwardingPipeline()
@@ -71,6 +99,12 @@ class TestForwardingPipelineBasics:
         assert pipeline.generate_upstream_tag() == b"P0002"
         assert pipeline.generate_upstream_tag() == b"P0003"
 
+    def test_generate_upstream_tag_widens_past_four_digits(self) -> None:
+        """generate_upstream_tag should keep counting beyond P9999."""
+        pipeline = ForwardingPipeline()
+        pipeline._tag_counter = itertools.count(10000)
+        assert pipeline.generate_upstream_tag() == b"P10000"
+
 
 class TestForwardCommand:
     """Tests for ForwardingPipeline.forward_command."""
@@ -124,6 +158,31 @@ class TestForwardCommand:
         assert pipeline.in_flight_count == 1
         assert b"A001" in pipeline.in_flight_client_tags
 
+    def test_in_flight_client_tags_is_live_view(self) -> None:
+        """in_flight_client_tags should reflect later pipeline changes."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        tags = pipeline.in_flight_client_tags
+
+        pipeline.forward_command(b"A001", "NOOP", None, upstream)
+        assert set(tags) == {b"A001"}
+
+        pipeline.cancel_by_client_tag(b"A001")
+        assert len(tags) == 0
+
+    def test_forward_command_skips_timestamp_without_debug(self, caplog) -> None:
+        """forward_command should only read the clock when debug logging is on."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+
+        with caplog.at_level(logging.INFO, logger="imap_granular_access_proxy.forwarding"):
+            quiet = pipeline.forward_command(b"A001", "NOOP", None, upstream)
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.forwarding"):
+            traced = pipeline.forward_command(b"A002", "NOOP", None, upstream)
+
+        assert quiet.timestamp == 0.0
+        assert traced.timestamp > 0
+
     def test_forward_multiple_commands(self) -> None:
         """forward_command should handle multiple concurrent commands."""
         pipeline = ForwardingPipeline()
@@ -140,6 +199,15 @@ class TestForwardCommand:
             b"P0003 CAPABILITY",
         ]
 
+    def test_forward_unknown_command_name(self) -> None:
+        """forward_command should encode command names outside the known set."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+
+        pipeline.forward_command(b"A001", "XLIST", b'"" "*"', upstream)
+
+        assert upstream.sent_lines == [b'P0001 XLIST "" "*"']
+
     def test_forward_duplicate_client_tag_raises(self) -> None:
         """forward_command should raise on duplicate client tag."""
         pipeline = ForwardingPipeline()
@@ -150,6 +218,143 @@ class TestForwardCommand:
         with pytest.raises(ValueError, match="already in flight"):
             pipeline.forward_command(b"A001", "CAPABILITY", None, upstream)
 
+    def test_forward_duplicate_client_tag_keeps_original(self) -> None:
+        """A rejected duplicate should leave the original command untouched."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        client = MockSender()
+
+        pipeline.forward_command(b"A001", "NOOP", None, upstream)
+        with pytest.raises(ValueError):
+            pipeline.forward_command(b"A001", "CAPABILITY", None, upstream)
+
+        assert upstream.sent_lines == [b"P0001 NOOP"]
+        assert pipeline.in_flight_count == 1
+        assert pipeline.route_response(b"P0001 OK done", client) is True
+        assert client.sent_lines == [b"A001 OK done"]
+
+
+class TestForwardCommandsBatch:
+    """Tests for ForwardingPipeline.forward_commands_batch."""
+
+    def test_batch_written_in_single_write(self) -> None:
+        """forward_commands_batch should write all lines with one call."""
+        pipeline = ForwardingPipeline()
+        transport = MockTransport()
+
+        cmds = pipeline.forward_commands_batch(
+            [
+                (b"A001", "FETCH", b"1 (FLAGS)"),
+                (b"A002", "FETCH", b"2 (FLAGS)"),
+                (b"A003", "NOOP", None),
+            ],
+            transport,
+        )
+
+        assert transport.writes == [
+            b"P0001 FETCH 1 (FLAGS)\r\nP0002 FETCH 2 (FLAGS)\r\nP0003 NOOP\r\n"
+        ]
+        assert [cmd.client_tag for cmd in cmds] == [b"A001", b"A002", b"A003"]
+        assert pipeline.in_flight_count == 3
+
+    def test_batch_responses_routed_by_tag(self) -> None:
+        """Responses to batched commands should route back individually."""
+        pipeline = ForwardingPipeline()
+        transport = MockTransport()
+        client = MockSender()
+
+        pipeline.forward_commands_batch(
+            [(b"A001", "NOOP", None), (b"A002", "NOOP", None)], transport
+        )
+        pipeline.route_response(b"P0002 OK NOOP completed", client)
+        pipeline.route_response(b"P0001 OK NOOP completed", client)
+
+        assert client.sent_lines == [b"A002 OK NOOP completed", b"A001 OK NOOP completed"]
+        assert pipeline.in_flight_count == 0
+
+    def test_batch_empty_writes_nothing(self) -> None:
+        """An empty batch should not touch the transport."""
+        pipeline = ForwardingPipeline()
+        transport = MockTransport()
+
+        assert pipeline.forward_commands_batch([], transport) == []
+        assert transport.writes == []
+
+    def test_batch_duplicate_tag_rejected_atomically(self) -> None:
+        """A duplicate tag inside the batch should forward nothing."""
+        pipeline = ForwardingPipeline()
+        transport = MockTransport()
+
+        with pytest.raises(ValueError, match="already in flight"):
+            pipeline.forward_commands_batch(
+                [(b"A001", "NOOP", None), (b"A001", "NOOP", None)], transport
+            )
+
+        assert transport.writes == []
+        assert pipeline.in_flight_count == 0
+
+    def test_batch_tag_already_in_flight_rejected(self) -> None:
+        """A batch reusing an in-flight client tag should forward nothing."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        transport = MockTransport()
+
+        pipeline.forward_command(b"A001", "NOOP", None, upstream)
+
+        with pytest.raises(ValueError, match="already in flight"):
+            pipeline.forward_commands_batch(
+                [(b"A002", "NOOP", None), (b"A001", "NOOP", None)], transport
+            )
+
+        assert transport.writes == []
+        assert pipeline.in_flight_count == 1
+
+
+class TestRouteResponsesBatch:
+    """Tests for ForwardingPipeline.route_responses_batch."""
+
+    def test_burst_written_in_single_write(self) -> None:
+        """Untagged and tagged lines should reach the client in one write."""
+        pipeline = ForwardingPipeline()
+        pipeline.forward_command(b"A001", "FETCH", b"1:2 (FLAGS)", MockSender())
+        transport = MockTransport()
+
+        completed = pipeline.route_responses_batch(
+            [
+                b"* 1 FETCH (FLAGS (\\Seen))",
+                b"* 2 FETCH (FLAGS ())",
+                b"P0001 OK FETCH completed",
+            ],
+            transport,
+        )
+
+        assert completed == 1
+        assert transport.writes == [
+            b"* 1 FETCH (FLAGS (\\Seen))\r\n"
+            b"* 2 FETCH (FLAGS ())\r\n"
+            b"A001 OK FETCH completed\r\n"
+        ]
+        assert pipeline.in_flight_count == 0
+
+    def test_unknown_tags_passed_through(self) -> None:
+        """Lines with unknown tags should be written unchanged."""
+        pipeline = ForwardingPipeline()
+        transport = MockTransport()
+
+        completed = pipeline.route_responses_batch([b"X999 OK whatever"], transport)
+
+        assert completed == 0
+        assert transport.writes == [b"X999 OK whatever\r\n"]
+
+    def test_empty_burst_writes_nothing(self) -> None:
+        """Empty input, or only empty lines, should not touch the transport."""
+        pipeline = ForwardingPipeline()
+        transport = MockTransport()
+
+        assert pipeline.route_responses_batch([], transport) == 0
+        assert pipeline.route_responses_batch([b""], transport) == 0
+        assert transport.writes == []
+
 
 class TestRouteResponse:
     """Tests for ForwardingPipeline.route_response."""
@@ -195,6 +400,33 @@ class TestRouteResponse:
         assert result is True
         assert client.sent_lines[0] == b"A001 BAD Unknown command"
 
+    def test_route_completion_logged_at_debug(self, caplog) -> None:
+        """route_response should log completed commands when DEBUG is enabled."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        client = MockSender()
+
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.forwarding"):
+            pipeline.forward_command(b"A001", "NOOP", None, upstream)
+            pipeline.route_response(b"P0001 OK NOOP completed", client)
+
+        assert "Command completed" in caplog.text
+        assert "elapsed=" in caplog.text
+
+    def test_route_completion_without_timestamp_omits_elapsed(self, caplog) -> None:
+        """A command forwarded while DEBUG was off should be logged without elapsed."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        client = MockSender()
+
+        with caplog.at_level(logging.INFO, logger="imap_granular_access_proxy.forwarding"):
+            pipeline.forward_command(b"A001", "NOOP", None, upstream)
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.forwarding"):
+            pipeline.route_response(b"P0001 OK NOOP completed", client)
+
+        assert "Command completed: client=b'A001' upstream=b'P0001' cmd=NOOP" in caplog.text
+        assert "elapsed=" not in caplog.text
+
     def test_route_untagged_response(self) -> None:
         """route_response should pass through untagged responses."""
         pipeline = ForwardingPipeline()
@@ -248,6 +480,20 @@ class TestRouteResponse:
         assert result is False
         assert client.sent_lines[0] == b"UNKNOWN OK Something"
 
+    def test_route_non_canonical_tag_passes_through(self) -> None:
+        """route_response should only rewrite tags exactly as generated."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        client = MockSender()
+
+        pipeline.forward_command(b"A001", "NOOP", None, upstream)
+
+        result = pipeline.route_response(b"P01 OK NOOP completed", client)
+
+        assert result is False
+        assert client.sent_lines[0] == b"P01 OK NOOP completed"
+        assert pipeline.in_flight_count == 1
+
     def test_route_multiple_responses_in_order(self) -> None:
         """route_response should handle interleaved responses correctly."""
         pipeline = ForwardingPipeline()
@@ -274,6 +520,63 @@ class TestRouteResponse:
         assert pipeline.in_flight_count == 0
 
 
+class TestSlotOverflow:
+    """Tests for commands whose direct-mapped slot is already taken."""
+
+    def _fill(self, pipeline: ForwardingPipeline, count: int) -> None:
+        upstream = MockSender()
+        for i in range(1, count + 1):
+            pipeline.forward_command(b"A%03d" % i, "NOOP", None, upstream)
+
+    def test_colliding_commands_all_tracked(self) -> None:
+        """Commands sharing a slot should all remain individually reachable."""
+        pipeline = ForwardingPipeline()
+        self._fill(pipeline, 130)
+
+        assert pipeline.in_flight_count == 130
+        for tag in (b"P0001", b"P0065", b"P0129"):
+            cmd = pipeline.get_forwarded_by_upstream_tag(tag)
+            assert cmd is not None
+            assert cmd.upstream_tag == tag
+        found = pipeline.get_forwarded_by_client_tag(b"A065")
+        assert found is not None
+        assert found.upstream_tag == b"P0065"
+
+    def test_colliding_commands_route_in_any_order(self) -> None:
+        """Responses should route correctly for slotted and overflowed commands."""
+        pipeline = ForwardingPipeline()
+        client = MockSender()
+        self._fill(pipeline, 65)
+
+        assert pipeline.route_response(b"P0065 OK done", client) is True
+        assert pipeline.route_response(b"P0001 OK done", client) is True
+
+        assert client.sent_lines == [b"A065 OK done", b"A001 OK done"]
+        assert pipeline.in_flight_count == 63
+        assert pipeline.get_forwarded_by_upstream_tag(b"P0065") is None
+
+    def test_cancel_overflowed_command(self) -> None:
+        """cancel_by_client_tag should remove commands from the overflow."""
+        pipeline = ForwardingPipeline()
+        self._fill(pipeline, 65)
+
+        cancelled = pipeline.cancel_by_client_tag(b"A065")
+
+        assert cancelled is not None
+        assert cancelled.upstream_tag == b"P0065"
+        assert pipeline.get_forwarded_by_upstream_tag(b"P0001") is not None
+        assert pipeline.in_flight_count == 64
+
+    def test_clear_all_clears_overflow(self) -> None:
+        """clear_all should drop slotted and overflowed commands alike."""
+        pipeline = ForwardingPipeline()
+        self._fill(pipeline, 65)
+
+        assert pipeline.clear_all() == 65
+        assert pipeline.in_flight_count == 0
+        assert pipeline.get_forwarded_by_upstream_tag(b"P0065") is None
+
+
 class TestLookupMethods:
     """Tests for lookup methods."""
 
@@ -309,6 +612,28 @@ class TestLookupMethods:
 
         assert pipeline.get_forwarded_by_upstream_tag(b"P9999") is None
 
+    def test_get_forwarded_by_upstream_tag_requires_exact_tag(self) -> None:
+        """get_forwarded_by_upstream_tag should not match re-padded tags."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+
+        pipeline.forward_command(b"A001", "NOOP", None, upstream)
+
+        assert pipeline.get_forwarded_by_upstream_tag(b"P1") is None
+        assert pipeline.get_forwarded_by_upstream_tag(b"Q0001") is None
+        # Decodes to 65, which shares P0001's slot; must still not match
+        assert pipeline.get_forwarded_by_upstream_tag(b"P000" + bytes([49 + 64])) is None
+
+    def test_get_forwarded_by_upstream_tag_past_four_digits(self) -> None:
+        """get_forwarded_by_upstream_tag should handle tags wider than P9999."""
+        pipeline = ForwardingPipeline()
+        upstream = MockSender()
+        pipeline._tag_counter = itertools.count(12345)
+
+        sent_cmd = pipeline.forward_command(b"A001", "NOOP", None, upstream)
+
+        assert pipeline.get_forwarded_by_upstream_tag(b"P12345") is sent_cmd
+
 
 class TestCleanup:
     """Tests for cleanup methods."""
@@ -1,7 +1,11 @@
 """Tests for TCP server infrastructure."""
 
+import logging
+
 import pytest
 from twisted.internet import protocol
+from twisted.internet.address import IPv4Address
+from twisted.internet.testing import StringTransport
 from twisted.mail import imap4
 
 from imap_granular_access_proxy.server import (
@@ -35,6 +39,13 @@ class TestIMAPServerProtocol:
         proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
         assert isinstance(proto.imap_state, IMAPState)
 
+    def test_imap_state_covers_all_twisted_states(self) -> None:
+        """imap_state should map every Twisted state string to its enum member."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        for state in IMAPState:
+            proto.state = state.value
+            assert proto.imap_state is state
+
     def test_selected_mailbox_initially_none(self) -> None:
         """selected_mailbox should be None when not in SELECTED state."""
         proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
@@ -47,6 +58,179 @@ class TestIMAPServerProtocol:
         assert proto.check_command(b"A002", "SELECT", b"INBOX") is True
         assert proto.check_command(b"A003", "FETCH", b"1:* FLAGS") is True
 
+    def test_check_command_enforces_allowed_commands(self) -> None:
+        """Commands outside allowed_commands should be rejected with NO."""
+
+        class RestrictedProtocol(IMAPServerProtocol):
+            allowed_commands = frozenset({"NOOP", "LOGOUT"})
+
+        proto = RestrictedProtocol()
+        proto.makeConnection(StringTransport())
+        proto.transport.clear()  # type: ignore[union-attr]
+
+        assert proto.check_command(b"A001", "NOOP", None) is True
+        assert proto.check_command(b"A002", "SELECT", b"INBOX") is False
+        assert proto.transport.value() == b"A002 NO Command not permitted\r\n"  # type: ignore[union-attr]
+
+    def test_rejection_leaves_pending_command_with_same_tag(self) -> None:
+        """Rejecting a command should not complete an in-flight one sharing its tag."""
+
+        class RestrictedProtocol(IMAPServerProtocol):
+            allowed_commands = frozenset({"IDLE"})
+
+        proto = RestrictedProtocol()
+        proto.makeConnection(StringTransport())
+        pending = proto.tag_tracker.register_command(b"A1", "IDLE", None)
+
+        assert proto.check_command(b"A1", "DELETE", b"INBOX") is False
+        assert proto.tag_tracker.get_pending(b"A1") is pending
+        assert set(proto.tag_tracker.pending_tags) == {b"A1"}
+
+    def test_rejected_uid_subcommand_releases_tag(self) -> None:
+        """A rejected UID subcommand should complete the tag UID registered."""
+
+        class RestrictedProtocol(IMAPServerProtocol):
+            allowed_commands = frozenset({"UID", "NOOP"})
+
+        proto = RestrictedProtocol()
+        transport = StringTransport()
+        proto.makeConnection(transport)
+        proto.state = "select"
+        transport.clear()
+
+        proto.dataReceived(b"A1 UID STORE 1 +FLAGS (\\Seen)\r\n")
+        assert transport.value() == b"A1 NO Command not permitted\r\n"
+        assert len(proto.tag_tracker.pending_tags) == 0
+
+        transport.clear()
+        proto.dataReceived(b"A1 NOOP\r\n")
+        assert transport.value() == b"A1 OK NOOP No operation performed\r\n"
+
+    def test_allowed_uid_subcommand_runs(self) -> None:
+        """An allowed UID subcommand should run under the outer UID tag."""
+
+        class RestrictedProtocol(IMAPServerProtocol):
+            allowed_commands = frozenset({"UID", "FETCH"})
+
+        class EmptyMailbox:
+            def fetch(self, messages: object, uid: int) -> list[object]:
+                return []
+
+        proto = RestrictedProtocol()
+        transport = StringTransport()
+        proto.makeConnection(transport)
+        proto.state = "select"
+        proto.mbox = EmptyMailbox()
+        transport.clear()
+
+        proto.dataReceived(b"A1 UID FETCH 1 FLAGS\r\n")
+
+        assert transport.value() == b"A1 OK FETCH completed\r\n"
+        assert len(proto.tag_tracker.pending_tags) == 0
+
+
+class TestIMAPServerProtocolConnection:
+    """Tests for IMAPServerProtocol connection lifecycle."""
+
+    def test_peer_logged_on_connect_and_disconnect(self, caplog) -> None:
+        """Connect and disconnect should both log the peer address."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        transport = StringTransport(peerAddress=IPv4Address("TCP", "192.0.2.7", 4321))
+
+        with caplog.at_level(logging.INFO, logger="imap_granular_access_proxy.server"):
+            proto.makeConnection(transport)
+            proto.connectionLost()
+
+        assert "Client connected from 192.0.2.7:4321" in caplog.text
+        assert "Client disconnected from 192.0.2.7:4321" in caplog.text
+
+    def test_peer_not_queried_when_info_disabled(self, caplog) -> None:
+        """connectionMade should skip getPeer() when INFO logging is off."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        transport = StringTransport()
+
+        def fail() -> None:
+            raise AssertionError("getPeer() called with INFO disabled")
+
+        transport.getPeer = fail  # type: ignore[method-assign]
+        with caplog.at_level(logging.WARNING, logger="imap_granular_access_proxy.server"):
+            proto.makeConnection(transport)
+            proto.connectionLost()
+
+    def test_disconnect_does_not_query_peer_again(self, caplog) -> None:
+        """connectionLost should reuse the peer captured on connect."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        transport = StringTransport(peerAddress=IPv4Address("TCP", "192.0.2.7", 4321))
+        caplog.set_level(logging.INFO, logger="imap_granular_access_proxy.server")
+        proto.makeConnection(transport)
+
+        def fail() -> None:
+            raise AssertionError("getPeer() called after connect")
+
+        transport.getPeer = fail  # type: ignore[method-assign]
+        proto.connectionLost()
+
+
+class TestIMAPServerProtocolLogging:
+    """Tests for IMAPServerProtocol line logging."""
+
+    def test_long_lines_truncated_in_debug_log(self, caplog) -> None:
+        """Debug logging should not repr a whole large line."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        proto.makeConnection(StringTransport())
+        line = b"* 1 FETCH (BODY[] " + b"x" * 10000 + b")"
+
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.server"):
+            proto.sendLine(line)
+
+        assert "more bytes>" in caplog.text
+        assert "x" * 1000 not in caplog.text
+        assert line in proto.transport.value()  # type: ignore[union-attr]
+
+    def test_short_lines_logged_verbatim(self, caplog) -> None:
+        """Lines within the limit should be logged unchanged."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        proto.makeConnection(StringTransport())
+
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.server"):
+            proto.sendLine(b"* OK still here")
+
+        assert "Sending: b'* OK still here'" in caplog.text
+
+
+class TestIMAPServerProtocolDispatch:
+    """Tests for IMAPServerProtocol.dispatchCommand."""
+
+    class RecordingProtocol(IMAPServerProtocol):
+        """Protocol that records the command names passed to check_command."""
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.checked: list[str] = []
+
+        def check_command(self, tag: bytes, cmd: str, args: bytes | None) -> bool:
+            self.checked.append(cmd)
+            return False
+
+    def test_known_command_name_is_shared(self) -> None:
+        """Known verbs should map to one shared str object, not a fresh decode."""
+        proto1 = self.RecordingProtocol()
+        proto2 = self.RecordingProtocol()
+
+        proto1.dispatchCommand(b"A001", b"SELECT", b"INBOX")
+        proto2.dispatchCommand(b"A001", b"SELECT", b"INBOX")
+
+        assert proto1.checked == ["SELECT"]
+        assert proto1.checked[0] is proto2.checked[0]
+
+    def test_unknown_command_name_is_decoded(self) -> None:
+        """Verbs outside the known set should still be decoded."""
+        proto = self.RecordingProtocol()
+
+        proto.dispatchCommand(b"A001", b"XFOO", None)
+
+        assert proto.checked == ["XFOO"]
+
 
 class TestIMAPState:
     """Tests for IMAPState enum."""
@@ -79,6 +263,12 @@ class TestIMAPState:
         assert IMAPState("logout") == IMAPState.LOGOUT
         assert IMAPState("timeout") == IMAPState.TIMEOUT
 
+    def test_members_equal_twisted_strings(self) -> None:
+        """Members should compare equal to Twisted's raw state strings."""
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        assert proto.state == IMAPState.NOT_AUTHENTICATED
+        assert IMAPState.SELECTED == "select"
+
 
 class TestIMAPServerFactory:
     """Tests for IMAPServerFactory."""
@@ -150,10 +340,19 @@ class TestPendingCommand:
         )
         assert cmd.upstream_tag == b"P0001"
 
+    def test_has_no_instance_dict(self) -> None:
+        """PendingCommand should use slots instead of a per-instance dict."""
+        cmd = PendingCommand(client_tag=b"A001", command="NOOP", args=None)
+        assert not hasattr(cmd, "__dict__")
+
 
 class TestCommandTagTracker:
     """Tests for CommandTagTracker."""
 
+    def test_has_no_instance_dict(self) -> None:
+        """CommandTagTracker should use slots instead of a per-instance dict."""
+        assert not hasattr(CommandTagTracker(), "__dict__")
+
     def test_initial_state(self) -> None:
         """New tracker should be empty."""
         tracker = CommandTagTracker()
@@ -171,6 +370,18 @@ class TestCommandTagTracker:
         assert cmd.args == b"INBOX"
         assert tracker.pending_count == 1
 
+    def test_register_skips_timestamp_without_debug(self, caplog) -> None:
+        """register_command should only read the clock when debug logging is on."""
+        tracker = CommandTagTracker()
+
+        with caplog.at_level(logging.INFO, logger="imap_granular_access_proxy.server"):
+            quiet = tracker.register_command(b"A001", "NOOP", None)
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.server"):
+            traced = tracker.register_command(b"A002", "NOOP", None)
+
+        assert quiet.timestamp == 0.0
+        assert traced.timestamp > 0
+
     def test_register_multiple_commands(self) -> None:
         """Should track multiple commands with different tags."""
         tracker = CommandTagTracker()
@@ -181,6 +392,15 @@ class TestCommandTagTracker:
         assert tracker.pending_count == 3
         assert tracker.pending_tags == frozenset({b"A001", b"A002", b"A003"})
 
+    def test_pending_tags_is_live_view(self) -> None:
+        """pending_tags should reflect later changes without being re-read."""
+        tracker = CommandTagTracker()
+        tags = tracker.pending_tags
+        tracker.register_command(b"A001", "NOOP", None)
+        assert b"A001" in tags
+        tracker.complete_command(b"A001")
+        assert len(tags) == 0
+
     def test_register_duplicate_tag_raises(self) -> None:
         """Should raise ValueError for duplicate tag."""
         tracker = CommandTagTracker()
@@ -189,6 +409,17 @@ class TestCommandTagTracker:
         with pytest.raises(ValueError, match="Duplicate command tag"):
             tracker.register_command(b"A001", "NOOP", None)
 
+    def test_register_duplicate_keeps_original(self) -> None:
+        """A rejected duplicate should not replace the pending command."""
+        tracker = CommandTagTracker()
+        original = tracker.register_command(b"A001", "SELECT", b"INBOX")
+
+        with pytest.raises(ValueError):
+            tracker.register_command(b"A001", "NOOP", None)
+
+        assert tracker.get_pending(b"A001") is original
+        assert tracker.pending_count == 1
+
     def test_has_pending(self) -> None:
         """has_pending should return correct boolean."""
         tracker = CommandTagTracker()
@@ -219,6 +450,29 @@ class TestCommandTagTracker:
         assert tracker.pending_count == 0
         assert tracker.has_pending(b"A001") is False
 
+    def test_complete_command_logged_at_debug(self, caplog) -> None:
+        """complete_command should log the elapsed time when DEBUG is enabled."""
+        tracker = CommandTagTracker()
+
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.server"):
+            tracker.register_command(b"A001", "SELECT", b"INBOX")
+            tracker.complete_command(b"A001")
+
+        assert "Completed command" in caplog.text
+        assert "elapsed=" in caplog.text
+
+    def test_complete_command_without_timestamp_omits_elapsed(self, caplog) -> None:
+        """A command registered while DEBUG was off should be logged without elapsed."""
+        tracker = CommandTagTracker()
+        with caplog.at_level(logging.INFO, logger="imap_granular_access_proxy.server"):
+            tracker.register_command(b"A001", "SELECT", b"INBOX")
+
+        with caplog.at_level(logging.DEBUG, logger="imap_granular_access_proxy.server"):
+            tracker.complete_command(b"A001")
+
+        assert "Completed command: tag=b'A001' cmd=SELECT" in caplog.text
+        assert "elapsed=" not in caplog.text
+
     def test_complete_nonexistent_returns_none(self) -> None:
         """complete_command should return None for unknown tag."""
         tracker = CommandTagTracker()
@@ -239,6 +493,14 @@ class TestCommandTagTracker:
         # All tags should be unique
         assert len({tag1, tag2, tag3}) == 3
 
+    def test_generate_upstream_tag_does_not_wrap(self) -> None:
+        """Tags should stay unique past P9999 instead of wrapping around."""
+        tracker = CommandTagTracker()
+        tags = [tracker.generate_upstream_tag() for _ in range(10001)]
+
+        assert tags[-2:] == [b"P10000", b"P10001"]
+        assert len(set(tags)) == len(tags)
+
     def test_clear_all(self) -> None:
         """clear_all should remove all pending commands."""
         tracker = CommandTagTracker()
@@ -0,0 +1,64 @@
+"""Tests for TCP socket tuning."""
+
+from twisted.internet.testing import StringTransport
+
+from imap_granular_access_proxy.server import IMAPServerProtocol
+from imap_granular_access_proxy.tcp import configure_tcp
+from imap_granular_access_proxy.upstream import UpstreamIMAPProtocol
+
+
+class TCPStringTransport(StringTransport):
+    """StringTransport that records the TCP options set on it."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.no_delay: bool | None = None
+        self.keep_alive: bool | None = None
+
+    def setTcpNoDelay(self, enabled: bool) -> None:
+        self.no_delay = enabled
+
+    def setTcpKeepAlive(self, enabled: bool) -> None:
+        self.keep_alive = enabled
+
+
+class TestConfigureTcp:
+    """Tests for configure_tcp."""
+
+    def test_enables_nodelay_and_keepalive(self) -> None:
+        """Both options should be switched on for TCP transports."""
+        transport = TCPStringTransport()
+        configure_tcp(transport)
+        assert transport.no_delay is True
+        assert transport.keep_alive is True
+
+    def test_ignores_transports_without_tcp_options(self) -> None:
+        """Transports without TCP options should be accepted unchanged."""
+        configure_tcp(StringTransport())
+
+    def test_ignores_socket_errors(self) -> None:
+        """A socket that refuses the options should not abort the connection."""
+
+        class ResetTransport(TCPStringTransport):
+            def setTcpNoDelay(self, enabled: bool) -> None:
+                raise ConnectionResetError(104, "Connection reset by peer")
+
+        transport = ResetTransport()
+        proto = IMAPServerProtocol()  # type: ignore[no-untyped-call]
+        proto.makeConnection(transport)
+        assert proto.connected
+        assert transport.value().startswith(b"* OK")
+
+    def test_applied_to_client_connections(self) -> None:
+        """The client-facing protocol should tune its socket on connect."""
+        transport = TCPStringTransport()
+        IMAPServerProtocol().makeConnection(transport)  # type: ignore[no-untyped-call]
+        assert transport.no_delay is True
+        assert transport.keep_alive is True
+
+    def test_applied_to_upstream_connections(self) -> None:
+        """The upstream protocol should tune its socket on connect."""
+        transport = TCPStringTransport()
+        UpstreamIMAPProtocol().makeConnection(transport)
+        assert transport.no_delay is True
+        assert transport.keep_alive is True
@@ -1,13 +1,23 @@
 """Tests for upstream IMAP client infrastructure."""
 
+import dataclasses
+import logging
+
 import pytest
-from twisted.internet import protocol
+from twisted.internet import defer, protocol
+from twisted.internet.address import IPv4Address
+from twisted.internet.error import ConnectionDone
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
 from twisted.mail import imap4
+from twisted.python.failure import Failure
 
 from imap_granular_access_proxy.upstream import (
     UpstreamConfig,
     UpstreamIMAPClientFactory,
     UpstreamIMAPProtocol,
+    UpstreamPool,
+    _tls_options,
 )
 
 
@@ -55,6 +65,10 @@ class TestUpstreamConfig:
         except AttributeError:
             pass  # Expected for frozen dataclass
 
+    def test_has_no_instance_dict(self, sample_config: UpstreamConfig) -> None:
+        """UpstreamConfig should use slots instead of a per-instance dict."""
+        assert not hasattr(sample_config, "__dict__")
+
 
 class TestUpstreamIMAPProtocol:
     """Tests for UpstreamIMAPProtocol."""
@@ -73,6 +87,100 @@ class TestUpstreamIMAPProtocol:
         proto = UpstreamIMAPProtocol()
         assert proto._greeting_deferred is None
 
+    def test_peer_logged_on_connect_and_disconnect(self, caplog) -> None:
+        """Connect and disconnect should both log the upstream address."""
+        proto = UpstreamIMAPProtocol()
+        transport = StringTransport(peerAddress=IPv4Address("TCP", "192.0.2.9", 993))
+
+        with caplog.at_level(logging.INFO, logger="imap_granular_access_proxy.upstream"):
+            proto.makeConnection(transport)
+            transport.getPeer = None  # type: ignore[assignment]
+            proto.connectionLost()
+
+        assert "Connected to upstream 192.0.2.9:993" in caplog.text
+        assert "Disconnected from upstream 192.0.2.9:993" in caplog.text
+
+    def test_peer_not_queried_when_info_disabled(self, caplog) -> None:
+        """connectionMade should skip getPeer() when INFO logging is off."""
+        proto = UpstreamIMAPProtocol()
+        transport = StringTransport()
+        transport.getPeer = None  # type: ignore[assignment]
+
+        with caplog.at_level(logging.WARNING, logger="imap_granular_access_proxy.upstream"):
+            proto.makeConnection(transport)
+            proto.connectionLost()
+
+
+
+class TestUpstreamIMAPProtocolPipelining:
+    """Tests for UpstreamIMAPProtocol.send_command."""
+
+    def _connect(self) -> tuple[UpstreamIMAPProtocol, StringTransport]:
+        proto = UpstreamIMAPProtocol()
+        transport = StringTransport()
+        proto.makeConnection(transport)
+        proto.dataReceived(b"* OK IMAP4rev1 ready\r\n")
+        transport.clear()
+        return proto, transport
+
+    def test_commands_written_without_waiting(self) -> None:
+        """Every command should be on the wire before any response arrives."""
+        proto, transport = self._connect()
+
+        proto.send_command("NOOP")
+        proto.send_command("STATUS", b"INBOX (MESSAGES)")
+        proto.send_command("NOOP")
+
+        assert transport.value() == (
+            b"K0001 NOOP\r\nK0002 STATUS INBOX (MESSAGES)\r\nK0003 NOOP\r\n"
+        )
+
+    def test_completions_matched_by_tag(self) -> None:
+        """Completions should fire their own command's Deferred in any order."""
+        proto, _ = self._connect()
+        results: list[tuple[int, bytes]] = []
+        for n in range(3):
+            proto.send_command("NOOP").addCallback(lambda r, n=n: results.append((n, r)))
+
+        proto.dataReceived(b"K0002 OK second\r\nK0001 OK first\r\nK0003 OK third\r\n")
+
+        assert results == [(1, b"OK second"), (0, b"OK first"), (2, b"OK third")]
+
+    def test_no_response_fails_deferred(self) -> None:
+        """A NO or BAD completion should fail the Deferred with IMAP4Exception."""
+        proto, _ = self._connect()
+        failures: list[Failure] = []
+        proto.send_command("SELECT", b"Missing").addErrback(failures.append)
+
+        proto.dataReceived(b"K0001 NO no such mailbox\r\n")
+
+        assert len(failures) == 1
+        assert failures[0].check(imap4.IMAP4Exception)
+        assert failures[0].getErrorMessage() == "b'NO no such mailbox'"
+
+    def test_connection_lost_fails_in_flight(self) -> None:
+        """Commands still in flight should fail when the connection drops."""
+        proto, _ = self._connect()
+        failures: list[Failure] = []
+        proto.send_command("NOOP").addErrback(failures.append)
+
+        proto.connectionLost(Failure(ConnectionDone()))
+
+        assert len(failures) == 1
+        assert failures[0].check(ConnectionDone)
+
+    def test_untagged_lines_left_to_imap4client(self) -> None:
+        """Untagged responses should still reach IMAP4Client's handlers."""
+        proto, _ = self._connect()
+        exists: list[int] = []
+        proto.newMessages = lambda count, recent: exists.append(count)  # type: ignore[method-assign]
+        d = proto.send_command("NOOP")
+
+        proto.dataReceived(b"* 3 EXISTS\r\nK0001 OK done\r\n")
+
+        assert exists == [3]
+        assert d.called
+
 
 class TestUpstreamIMAPClientFactory:
     """Tests for UpstreamIMAPClientFactory."""
@@ -117,9 +225,178 @@ class TestUpstreamIMAPClientFactory:
         proto = factory.buildProtocol(MockAddress())  # type: ignore[arg-type]
         assert factory._protocol is proto
 
+    def test_build_protocol_registers_shared_authenticators(
+        self, sample_config: UpstreamConfig
+    ) -> None:
+        """Each protocol should get PLAIN, LOGIN and CRAM-MD5, built once per factory."""
+        factory = UpstreamIMAPClientFactory(sample_config)
+        first = factory.buildProtocol(None)  # type: ignore[arg-type]
+        second = factory.buildProtocol(None)  # type: ignore[arg-type]
+
+        assert set(first.authenticators) == {b"PLAIN", b"LOGIN", b"CRAM-MD5"}
+        for name, authenticator in first.authenticators.items():
+            assert second.authenticators[name] is authenticator
+
     def test_initial_connection_deferred_is_none(
         self, sample_config: UpstreamConfig
     ) -> None:
         """_connection_deferred should be None initially."""
         factory = UpstreamIMAPClientFactory(sample_config)
         assert factory._connection_deferred is None
+
+
+class TestTLSOptions:
+    """Tests for the cached upstream TLS options."""
+
+    def test_options_reused_per_hostname(self) -> None:
+        """Repeated lookups for a host should return the same options object."""
+        assert _tls_options("imap.example.com") is _tls_options("imap.example.com")
+
+    def test_options_differ_between_hostnames(self) -> None:
+        """Each hostname should get its own options for certificate checks."""
+        assert _tls_options("imap.example.com") is not _tls_options("mail.example.org")
+
+
+def _connected_protocol(config: UpstreamConfig) -> UpstreamIMAPProtocol:
+    """Build an upstream protocol connected to a StringTransport."""
+    proto = UpstreamIMAPClientFactory(config).buildProtocol(None)  # type: ignore[arg-type]
+    proto.makeConnection(StringTransport())
+    return proto
+
+
+class TestUpstreamPool:
+    """Tests for UpstreamPool."""
+
+    def test_checkout_reuses_checked_in_connection(
+        self, sample_config: UpstreamConfig
+    ) -> None:
+        """A checked-in connection should be handed out on the next checkout."""
+        pool = UpstreamPool(Clock())
+        proto = _connected_protocol(sample_config)
+        pool.checkin(proto)
+        assert pool.idle_count == 1
+
+        results: list[UpstreamIMAPProtocol] = []
+        pool.checkout(sample_config).addCallback(results.append)
+
+        assert results == [proto]
+        assert pool.idle_count == 0
+
+    def test_connections_keyed_by_account(self, sample_config: UpstreamConfig) -> None:
+        """Connections for another account should not be reused."""
+        pool = UpstreamPool(Clock())
+        other = UpstreamConfig(
+            host=sample_config.host,
+            port=sample_config.port,
+            username="other@example.com",
+            password="test-password-for-unit-tests",  # noqa: S106
+        )
+        pool.checkin(_connected_protocol(other))
+
+        assert pool._idle.get(sample_config) is None
+        assert len(pool._idle[other]) == 1
+
+    @pytest.mark.parametrize(
+        "changes",
+        [
+            {"use_tls": False},
+            {"password": "another-password-for-unit-tests"},
+            {"username": "other@example.com"},
+        ],
+    )
+    def test_different_config_never_reuses_connection(
+        self, sample_config: UpstreamConfig, changes: dict, monkeypatch
+    ) -> None:
+        """A checkout with a different TLS setting or credentials gets a new connection."""
+        fresh: defer.Deferred[UpstreamIMAPProtocol] = defer.Deferred()
+        connected: list[UpstreamConfig] = []
+
+        def fake_connect(factory: UpstreamIMAPClientFactory, reactor: object):
+            connected.append(factory.config)
+            return fresh
+
+        monkeypatch.setattr(UpstreamIMAPClientFactory, "connect", fake_connect)
+        pool = UpstreamPool(Clock())
+        pooled_config = dataclasses.replace(sample_config, **changes)
+        pool.checkin(_connected_protocol(pooled_config))
+
+        assert pool.checkout(sample_config) is fresh
+        assert connected == [sample_config]
+        assert pool.idle_count == 1
+
+    def test_checkin_closes_connections_beyond_max_idle(
+        self, sample_config: UpstreamConfig
+    ) -> None:
+        """Connections beyond max_idle should be closed rather than pooled."""
+        pool = UpstreamPool(Clock(), max_idle=1)
+        pool.checkin(_connected_protocol(sample_config))
+        extra = _connected_protocol(sample_config)
+        pool.checkin(extra)
+
+        assert pool.idle_count == 1
+        assert extra.transport.disconnecting  # type: ignore[union-attr]
+
+    def test_lost_connection_is_evicted(self, sample_config: UpstreamConfig) -> None:
+        """A pooled connection should leave the pool when it is lost."""
+        pool = UpstreamPool(Clock())
+        proto = _connected_protocol(sample_config)
+        pool.checkin(proto)
+
+        proto.connectionLost()
+
+        assert pool.idle_count == 0
+        assert proto._pool is None
+
+    def test_keepalive_sends_noop_to_idle_connections(
+        self, sample_config: UpstreamConfig
+    ) -> None:
+        """Idle connections should get a NOOP every keepalive interval."""
+        clock = Clock()
+        pool = UpstreamPool(clock, keepalive_interval=60)
+        proto = _connected_protocol(sample_config)
+        pool.checkin(proto)
+        pool.start()
+
+        clock.advance(59)
+        assert b"NOOP" not in proto.transport.value()  # type: ignore[union-attr]
+        clock.advance(1)
+        assert b"NOOP" in proto.transport.value()  # type: ignore[union-attr]
+
+        pool.stop()
+        assert not clock.getDelayedCalls()
+
+    def test_failed_keepalive_evicts_connection(
+        self, sample_config: UpstreamConfig
+    ) -> None:
+        """A connection whose keepalive fails should be dropped and closed."""
+        clock = Clock()
+        pool = UpstreamPool(clock, keepalive_interval=60)
+        proto = _connected_protocol(sample_config)
+        proto.noop = lambda: defer.fail(imap4.IMAP4Exception("gone"))  # type: ignore[method-assign]
+        pool.checkin(proto)
+        pool.start()
+
+        clock.advance(60)
+
+        assert pool.idle_count == 0
+        assert proto.transport.disconnecting  # type: ignore[union-attr]
+        pool.stop()
+
+    def test_failed_keepalive_leaves_checked_out_connection_open(
+        self, sample_config: UpstreamConfig
+    ) -> None:
+        """A keepalive failing after checkout should not close the caller's connection."""
+        clock = Clock()
+        pool = UpstreamPool(clock, keepalive_interval=60)
+        proto = _connected_protocol(sample_config)
+        noop: defer.Deferred[object] = defer.Deferred()
+        proto.noop = lambda: noop  # type: ignore[method-assign]
+        pool.checkin(proto)
+        pool.start()
+
+        clock.advance(60)
+        pool.checkout(sample_config)
+        noop.errback(imap4.IMAP4Exception("gone"))
+
+        assert not proto.transport.disconnecting  # type: ignore[union-attr]
+        pool.stop()